@@ -3,6 +3,18 @@ import os
 import io
 import zipfile
 import json
+import re
+import math
+import time
+import uuid
+import shutil
+import threading
+import functools
+import hashlib
+import bisect
+from array import array
+from collections import OrderedDict
+import multiprocessing
 from werkzeug.utils import secure_filename
 from PyPDF2 import PdfReader, PdfWriter, PdfMerger
 from PIL import Image
@@ -17,6 +29,7 @@ import pandas as pd # For Excel/CSV handling
 from pdf2docx import Converter # For PDF to Word
 import pytesseract # For OCR
 from pdf2image import convert_from_bytes # For PDF to Images
+from server_sizing import server_sizing
 
 # Note: For Word -> PDF, this works best on Windows/Mac with MS Word installed
 try:
@@ -24,33 +37,258 @@ try:
 except ImportError:
     docx_convert = None
 
+# Note: psutil is optional; without it the Word conversion memory budget is
+# read from /proc on Linux and skipped elsewhere
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
 
+# Server sizing; gunicorn.conf.py exports these, the dev server is one process
+SERVER_WORKERS = int(os.environ.get('PDFSUITE_WORKERS', 1))
+SERVER_SIZING = server_sizing(SERVER_WORKERS, int(os.environ.get('PDFSUITE_THREADS', 0)) or None)
+
+# Each server process runs one PDF → Word conversion at a time (see ADMISSION),
+# so these split the host's CPUs and memory between the server processes
+app.config['WORD_WORKERS'] = SERVER_SIZING['heavy_limit']  # max processes per PDF → Word conversion
+app.config['WORD_TIMEOUT'] = 300  # seconds allowed per PDF → Word conversion
+app.config['WORD_MEMORY_MB'] = max(512, 4096 // SERVER_WORKERS)  # memory budget per PDF → Word conversion (all workers)
+app.config['WORD_MIN_WORKER_MEMORY_MB'] = 512  # expected resident memory of one worker
+app.config['WORD_JOB_TTL'] = 3600  # seconds a finished conversion job is kept
+app.config['WORD_JOB_QUEUE'] = 4  # background jobs that may wait for a conversion slot
+app.config['WORD_JOB_WAIT'] = 1200  # seconds a background job may wait for its slot
+app.config['ADMISSION'] = SERVER_SIZING['classes']
+app.config['SEARCH_CACHE_MB'] = 256  # memory for cached search indexes (per server process)
+app.config['SEARCH_DISK_MB'] = 1024  # disk for saved search indexes
+app.config['SEARCH_MAX_HITS'] = 500  # upper bound on hits returned by one query
+
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'docx', 'xlsx', 'csv'}
 
+# ==========================================
+# ADMISSION CONTROL
+# ==========================================
+# Every route belongs to a class: 'light' page operations (split, rotate, ...),
+# 'heavy' OCR/conversion/whole-document jobs, 'word' for the multi-process
+# PDF → Word conversion, or 'status' for pages, job polls and metrics. Each
+# class has its own concurrency limit and bounded wait queue per server
+# process, so a burst in one class cannot starve another. server_sizing()
+# gives gunicorn exactly enough threads for every class's slots and queue.
+ADMISSION_STATS_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], 'admission_stats')
+admission_stats_lock = threading.Lock()
+admission_stats_published = False
+
+class AdmissionGate:
+    """Concurrency limit plus a bounded wait queue for one tool class."""
+
+    def __init__(self, name, limit, queue, timeout):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.avg_seconds = 1.0  # moving average of time a request holds a slot
+        self.condition = threading.Condition()
+
+    def acquire(self, timeout=None, queue=None):
+        """Take a slot, waiting in the queue if needed.
+
+        Returns None once admitted, 'queue_full' when the wait queue is full
+        and 'timeout' when no slot freed up in time. timeout and queue
+        override the class defaults for callers that may wait longer.
+        """
+        # Stats are published outside the condition: publishing reads every
+        # gate, so holding this one meanwhile could deadlock with another
+        with self.condition:
+            if self.active < self.limit:
+                self.active += 1
+                self.admitted += 1
+                result = None
+            elif self.queue_full(queue):
+                result = 'queue_full'
+            else:
+                self.waiting += 1
+                result = 'waiting'
+        publish_admission_stats()
+        if result != 'waiting':
+            return result
+
+        deadline = time.monotonic() + (timeout or self.timeout)
+        with self.condition:
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        result = 'timeout'
+                        break
+                    self.condition.wait(remaining)
+                else:
+                    self.active += 1
+                    self.admitted += 1
+                    result = None
+            finally:
+                self.waiting -= 1
+        publish_admission_stats()
+        return result
+
+    def queue_full(self, queue=None):
+        with self.condition:
+            if self.waiting >= (queue or self.queue):
+                self.rejected += 1
+                return True
+            return False
+
+    def release(self, seconds):
+        with self.condition:
+            self.active -= 1
+            self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * seconds
+            self.condition.notify()
+        publish_admission_stats()
+
+    def retry_after(self):
+        with self.condition:
+            backlog = self.waiting / self.limit + 1
+            return max(1, math.ceil(self.avg_seconds * backlog))
+
+    def stats(self):
+        with self.condition:
+            return {
+                'limit': self.limit,
+                'queue_size': self.queue,
+                'active': self.active,
+                'waiting': self.waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'avg_seconds': self.avg_seconds,
+            }
+
+admission_gates = {name: AdmissionGate(name, **cfg) for name, cfg in app.config['ADMISSION'].items()}
+
+def publish_admission_stats():
+    # Each server process keeps its gate stats in <pid>.json so the metrics
+    # endpoint can add up every process, whichever one answers the scrape
+    global admission_stats_published
+    with admission_stats_lock:
+        stats = {name: gate.stats() for name, gate in admission_gates.items()}
+        path = os.path.join(ADMISSION_STATS_FOLDER, f'{os.getpid()}.json')
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            os.makedirs(ADMISSION_STATS_FOLDER, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(stats, f)
+            os.replace(tmp_path, path)
+            admission_stats_published = True
+        except OSError:
+            pass  # metrics must never fail a request
+
+def process_alive(pid):
+    if psutil:
+        return psutil.pid_exists(pid)
+    if os.name == 'nt':
+        return True  # os.kill(pid, 0) would send CTRL_C_EVENT on Windows
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+@app.before_request
+def publish_admission_stats_once():
+    # Publish before the first gate changes so idle processes still count
+    if not admission_stats_published:
+        publish_admission_stats()
+
+def saturated_response(gate, reason):
+    # A full queue means the client should back off (429); a request that
+    # queued but never got a slot means the server is overloaded (503).
+    response = jsonify({'error': f'Too many {gate.name} requests in progress, please retry shortly'})
+    response.status_code = 429 if reason == 'queue_full' else 503
+    response.headers['Retry-After'] = str(gate.retry_after())
+    return response
+
+def admit(tool_class):
+    """Run the view only once a slot in the given tool class is free."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(*args, **kwargs):
+            gate = admission_gates[tool_class]
+            rejection = gate.acquire()
+            if rejection:
+                return saturated_response(gate, rejection)
+            started = time.monotonic()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                gate.release(time.monotonic() - started)
+        return wrapped
+    return decorator
+
+@app.route('/metrics/admission')
+@admit('status')
+def admission_metrics():
+    totals = {}
+    processes = 0
+    for name in os.listdir(ADMISSION_STATS_FOLDER):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(ADMISSION_STATS_FOLDER, name)
+        if not process_alive(int(name[:-len('.json')])):
+            try:
+                os.remove(path)  # left behind by a server process that exited
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            with open(path, encoding='utf-8') as f:
+                stats = json.load(f)
+        except (FileNotFoundError, ValueError):
+            continue
+        processes += 1
+        for tool_class, values in stats.items():
+            total = totals.setdefault(tool_class, {key: 0 for key in values})
+            for key, value in values.items():
+                if key == 'avg_seconds':
+                    value *= values['admitted']  # averaged below, weighted by admissions
+                total[key] += value
+    for total in totals.values():
+        total['avg_seconds'] = round(total['avg_seconds'] / total['admitted'], 3) if total['admitted'] else None
+    return jsonify({'processes': processes, 'classes': totals})
+
 @app.route('/')
+@admit('status')
 def index():
     return render_template('index.html')
 
 @app.route('/about')
+@admit('status')
 def about():
     return render_template('about.html')
 
 @app.route('/privacy')
+@admit('status')
 def privacy():
     return render_template('privacy.html') 
 @app.route('/services')
+@admit('status')
 def services():
     return render_template('services.html')
 
 # ==========================================
 
 @app.route('/merge', methods=['POST'])
+@admit('light')
 def merge_pdfs():
     try:
         files = request.files.getlist('files')
@@ -71,6 +309,7 @@ def merge_pdfs():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/split', methods=['POST'])
+@admit('light')
 def split_pdf():
     try:
         file = request.files['file']
@@ -107,6 +346,7 @@ def split_pdf():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/compress', methods=['POST'])
+@admit('heavy')
 def compress_pdf():
     try:
         file = request.files['file']
@@ -128,6 +368,7 @@ def compress_pdf():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/watermark', methods=['POST'])
+@admit('light')
 def add_watermark():
     try:
         file = request.files['file']
@@ -162,6 +403,7 @@ def add_watermark():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/protect', methods=['POST'])
+@admit('light')
 def protect_pdf():
     try:
         file = request.files['file']
@@ -182,6 +424,7 @@ def protect_pdf():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/unlock', methods=['POST'])
+@admit('light')
 def unlock_pdf():
     try:
         file = request.files['file']
@@ -204,6 +447,7 @@ def unlock_pdf():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/remove-pages', methods=['POST'])
+@admit('light')
 def remove_pages():
     try:
         file = request.files['file']
@@ -241,26 +485,331 @@ def remove_pages():
 # ==========================================
 
 # 1) PDF → Word
+# Pages are split into contiguous chunks and parsed by a pool of worker
+# processes; a further worker merges the parsed chunks into one document. Both
+# steps run under the same time and resident-memory budget. Progress is counted
+# per page and can be polled through the /pdf-to-word/jobs endpoints. Job
+# status is kept in a status.json next to the job's files so any server
+# process can answer a poll.
+WORD_JOBS_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], 'word_jobs')
+WORD_JOB_STALE_MARGIN = 300  # seconds past its deadline before an unfinished job is abandoned
+_word_progress = None  # shared page counter, set in each worker process
+
+class ConversionBudgetError(Exception):
+    pass
+
+class InvalidPagesError(ValueError):
+    pass
+
+def parse_page_ranges(page_ranges, total_pages):
+    """Turn '1-3,7' into sorted 0-based page indexes; empty means all pages."""
+    if not page_ranges:
+        return list(range(total_pages))
+    indexes = set()
+    for part in page_ranges.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if '-' in part:
+                start, end = map(int, part.split('-'))
+                indexes.update(range(start-1, end))
+            else:
+                indexes.add(int(part)-1)
+        except ValueError:
+            raise InvalidPagesError(f"Invalid pages '{part}'. Use a list like 1-3,7")
+    return sorted(i for i in indexes if 0 <= i < total_pages)
+
+def _init_word_worker(progress, pids):
+    global _word_progress
+    _word_progress = progress
+    with pids.get_lock():
+        for i in range(len(pids)):
+            if not pids[i]:
+                pids[i] = os.getpid()
+                break
+
+def _parse_word_chunk(args):
+    input_path, page_indexes, store_path = args
+    cv = Converter(input_path)
+    try:
+        settings = cv.default_settings
+        cv.load_pages(pages=page_indexes)
+        cv.parse_document(**settings)
+        for page in cv.pages:
+            if page.skip_parsing: continue
+            try:
+                page.parse(**settings)
+            except Exception:
+                if not settings['ignore_page_error']:
+                    raise
+            with _word_progress.get_lock():
+                _word_progress.value += 1
+        cv.serialize(store_path)
+    finally:
+        cv.close()
+
+def _merge_word_chunks(input_path, store_paths, output_path):
+    cv = Converter(input_path)
+    try:
+        for store_path in store_paths:
+            cv.deserialize(store_path)
+        cv.make_docx(output_path, **cv.default_settings)
+    finally:
+        cv.close()
+
+def process_rss_mb(pid):
+    if psutil:
+        try:
+            return psutil.Process(pid).memory_info().rss / (1024 * 1024)
+        except psutil.Error:
+            return 0
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0
+
+def run_word_workers(ctx, processes, progress, deadline, start, on_tick=None):
+    """Run start(pool) in a fresh pool, stopping it if the budget runs out."""
+    pids = ctx.Array('i', processes)
+    pool = ctx.Pool(processes, initializer=_init_word_worker, initargs=(progress, pids))
+    try:
+        result = start(pool)
+        while not result.ready():
+            if time.monotonic() > deadline:
+                raise ConversionBudgetError(f"Conversion exceeded the {app.config['WORD_TIMEOUT']}s time limit")
+            if sum(process_rss_mb(pid) for pid in pids[:] if pid) > app.config['WORD_MEMORY_MB']:
+                raise ConversionBudgetError(f"Conversion exceeded the {app.config['WORD_MEMORY_MB']}MB memory limit")
+            if on_tick:
+                on_tick()
+            result.wait(0.5)
+        return result.get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def convert_pdf_to_word(input_path, output_path, page_indexes, on_progress=None):
+    """Convert the given pages; on_progress(status, pages_done) reports 'running' then 'merging'."""
+    workers = min(app.config['WORD_WORKERS'], len(page_indexes),
+                  max(1, app.config['WORD_MEMORY_MB'] // app.config['WORD_MIN_WORKER_MEMORY_MB']))
+    size = -(-len(page_indexes) // workers)
+    chunks = [page_indexes[i:i + size] for i in range(0, len(page_indexes), size)]
+    work_dir = os.path.dirname(output_path)
+    store_paths = [os.path.join(work_dir, f'chunk-{i}.json') for i in range(len(chunks))]
+
+    # Spawn rather than fork: forking a multi-threaded server can copy locks
+    # held by other request threads into the child and deadlock it
+    ctx = multiprocessing.get_context('spawn')
+    progress = ctx.Value('i', 0)
+    deadline = time.monotonic() + app.config['WORD_TIMEOUT']
+    report = (lambda: on_progress('running', progress.value)) if on_progress else None
+    try:
+        run_word_workers(ctx, len(chunks), progress, deadline,
+                         lambda pool: pool.map_async(_parse_word_chunk, list(zip(
+                             [input_path] * len(chunks), chunks, store_paths))),
+                         report)
+        if on_progress:
+            on_progress('merging', progress.value)
+        run_word_workers(ctx, 1, progress, deadline,
+                         lambda pool: pool.apply_async(_merge_word_chunks, (input_path, store_paths, output_path)))
+    finally:
+        for store_path in store_paths:
+            if os.path.exists(store_path):
+                os.remove(store_path)
+
+def word_job_dir(job_id):
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+        return None
+    return os.path.join(WORD_JOBS_FOLDER, job_id)
+
+def save_word_job(job):
+    tmp_path = os.path.join(job['dir'], f'status.json.{uuid.uuid4().hex}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(job, f)
+    os.replace(tmp_path, os.path.join(job['dir'], 'status.json'))
+
+def load_word_job(job_id):
+    job_dir = word_job_dir(job_id)
+    if not job_dir:
+        return None
+    try:
+        with open(os.path.join(job_dir, 'status.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None  # removed by another server process, or not written yet
+
+def word_job_deadline(job):
+    """Latest time an unfinished job could still legitimately be queued or running."""
+    return job['created_at'] + app.config['WORD_JOB_WAIT'] + app.config['WORD_TIMEOUT'] + WORD_JOB_STALE_MARGIN
+
+def prune_word_jobs():
+    if not os.path.isdir(WORD_JOBS_FOLDER):
+        return
+    now = time.time()
+    for job_id in os.listdir(WORD_JOBS_FOLDER):
+        job = load_word_job(job_id)
+        if not job:
+            continue
+        if job['status'] in ('done', 'error'):
+            if job['finished_at'] < now - app.config['WORD_JOB_TTL']:
+                shutil.rmtree(job['dir'], ignore_errors=True)
+        elif word_job_deadline(job) < now:
+            # The server process running this job was restarted or killed
+            for path in (job['input_path'], job['output_path']):
+                if os.path.exists(path):
+                    os.remove(path)
+            job['status'] = 'error'
+            job['error'] = 'Conversion was interrupted, please try again'
+            job['finished_at'] = now
+            save_word_job(job)
+
+def create_word_job(file):
+    """Save the upload and its status.json; returns None if no pages are selected."""
+    job_id = uuid.uuid4().hex
+    job_dir = word_job_dir(job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    input_path = os.path.join(job_dir, 'input.pdf')
+    try:
+        file.save(input_path)
+        with fitz.open(input_path) as doc:
+            total_pages = len(doc)
+        page_indexes = parse_page_ranges(request.form.get('pages', '').strip(), total_pages)
+        if not page_indexes:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            return None
+
+        job = {
+            'id': job_id,
+            'dir': job_dir,
+            'input_path': input_path,
+            'output_path': os.path.join(job_dir, 'converted.docx'),
+            'pages': page_indexes,
+            'status': 'queued',
+            'pages_total': len(page_indexes),
+            'pages_done': 0,
+            'error': None,
+            'created_at': time.time(),
+            'finished_at': None,
+        }
+        save_word_job(job)  # lets prune_word_jobs collect it if this process dies
+        return job
+    except Exception:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise
+
+def run_word_job(job):
+    def report(status, pages_done):
+        if (status, pages_done) != (job['status'], job['pages_done']):
+            job['status'] = status
+            job['pages_done'] = pages_done
+            save_word_job(job)
+
+    report('running', 0)
+    try:
+        convert_pdf_to_word(job['input_path'], job['output_path'], job['pages'], report)
+        job['status'] = 'done'
+    except Exception as e:
+        job['status'] = 'error'
+        job['error'] = str(e)
+    job['finished_at'] = time.time()
+    save_word_job(job)
+
+def run_admitted_word_job(job):
+    # Background jobs wait for a 'word' slot here, in their own thread, while
+    # their status reads 'queued'; they get a longer queue and wait than requests
+    gate = admission_gates['word']
+    rejection = gate.acquire(timeout=app.config['WORD_JOB_WAIT'], queue=app.config['WORD_JOB_QUEUE'])
+    if rejection:
+        job['status'] = 'error'
+        job['error'] = 'Server busy, please try again later'
+        job['finished_at'] = time.time()
+        save_word_job(job)
+        return
+    started = time.monotonic()
+    try:
+        run_word_job(job)
+    finally:
+        gate.release(time.monotonic() - started)
+
 @app.route('/pdf-to-word', methods=['POST'])
+@admit('word')
 def pdf_to_word():
     try:
         file = request.files['file']
         if not file: return jsonify({'error': 'Invalid file'}), 400
         
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], 'input.pdf')
-        output_path = os.path.join(app.config['UPLOAD_FOLDER'], 'converted.docx')
-        file.save(input_path)
+        prune_word_jobs()
+        job = create_word_job(file)
+        if not job: return jsonify({'error': 'No valid pages selected'}), 400
+        
+        try:
+            convert_pdf_to_word(job['input_path'], job['output_path'], job['pages'])
+            with open(job['output_path'], 'rb') as f:
+                docx_bytes = io.BytesIO(f.read())
+            return send_file(docx_bytes, as_attachment=True, download_name='converted.docx')
+        finally:
+            shutil.rmtree(job['dir'], ignore_errors=True)
+    except InvalidPagesError as e:
+        return jsonify({'error': str(e)}), 400
+    except ConversionBudgetError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/pdf-to-word/jobs', methods=['POST'])
+@admit('light')
+def start_pdf_to_word_job():
+    try:
+        file = request.files['file']
+        if not file: return jsonify({'error': 'Invalid file'}), 400
         
-        cv = Converter(input_path)
-        cv.convert(output_path, start=0, end=None)
-        cv.close()
+        gate = admission_gates['word']
+        if gate.queue_full(app.config['WORD_JOB_QUEUE']):
+            return saturated_response(gate, 'queue_full')
+        
+        prune_word_jobs()
+        job = create_word_job(file)
+        if not job: return jsonify({'error': 'No valid pages selected'}), 400
         
-        return send_file(output_path, as_attachment=True, download_name='converted.docx')
+        threading.Thread(target=run_admitted_word_job, args=(job,), daemon=True).start()
+        return jsonify({'job_id': job['id'], 'status_url': f"/pdf-to-word/jobs/{job['id']}"}), 202
+    except InvalidPagesError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/pdf-to-word/jobs/<job_id>', methods=['GET'])
+@admit('status')
+def pdf_to_word_job_status(job_id):
+    job = load_word_job(job_id)
+    if not job: return jsonify({'error': 'Job not found'}), 404
+    
+    status = {key: job[key] for key in ('status', 'pages_total', 'pages_done', 'error')}
+    status['job_id'] = job_id
+    if job['status'] == 'done':
+        status['download_url'] = f'/pdf-to-word/jobs/{job_id}/download'
+    return jsonify(status)
+
+@app.route('/pdf-to-word/jobs/<job_id>/download', methods=['GET'])
+@admit('status')
+def pdf_to_word_job_download(job_id):
+    job = load_word_job(job_id)
+    if not job: return jsonify({'error': 'Job not found'}), 404
+    if job['status'] != 'done':
+        return jsonify({'error': 'Conversion not finished', 'status': job['status']}), 409
+    
+    try:
+        return send_file(job['output_path'], as_attachment=True, download_name='converted.docx')
+    except FileNotFoundError:
+        return jsonify({'error': 'Job not found'}), 404  # expired while we looked it up
+
 # 2) PDF → Excel
 @app.route('/pdf-to-excel', methods=['POST'])
+@admit('heavy')
 def pdf_to_excel():
     try:
         file = request.files['file']
@@ -291,6 +840,7 @@ def pdf_to_excel():
 
 # 3) PDF → CSV
 @app.route('/pdf-to-csv', methods=['POST'])
+@admit('heavy')
 def pdf_to_csv():
     try:
         file = request.files['file']
@@ -322,10 +872,12 @@ def pdf_to_csv():
 # 4) Extract Tables (Same backend as Excel)
 @app.route('/extract-tables', methods=['POST'])
 def extract_tables():
+    # Admitted as 'heavy' through pdf_to_excel
     return pdf_to_excel()
 
 # 5) OCR Text Extract
 @app.route('/ocr-pdf', methods=['POST'])
+@admit('heavy')
 def ocr_pdf():
     try:
         file = request.files['file']
@@ -347,6 +899,7 @@ def ocr_pdf():
 
 # 6) Images → PDF
 @app.route('/images-to-pdf', methods=['POST'])
+@admit('light')
 def images_to_pdf():
     try:
         files = request.files.getlist('files')
@@ -368,6 +921,7 @@ def images_to_pdf():
 
 # 7) PDF → Images (Replaces old 'convert-to-images')
 @app.route('/pdf-to-all-images', methods=['POST'])
+@admit('heavy')
 def pdf_to_all_images():
     try:
         file = request.files['file']
@@ -388,6 +942,7 @@ def pdf_to_all_images():
 
 # 8) PDF → Text
 @app.route('/pdf-to-text', methods=['POST'])
+@admit('heavy')
 def pdf_to_text_simple():
     try:
         file = request.files['file']
@@ -408,6 +963,7 @@ def pdf_to_text_simple():
 
 # 9) Word → PDF
 @app.route('/word-to-pdf', methods=['POST'])
+@admit('heavy')
 def word_to_pdf():
     try:
         file = request.files['file']
@@ -428,6 +984,7 @@ def word_to_pdf():
 
 # 10) Excel → PDF
 @app.route('/excel-to-pdf', methods=['POST'])
+@admit('heavy')
 def excel_to_pdf():
     try:
         file = request.files['file']
@@ -456,6 +1013,7 @@ def excel_to_pdf():
 
 # 11) Add E-Signature
 @app.route('/add-signature', methods=['POST'])
+@admit('light')
 def add_signature():
     try:
         pdf_file = request.files['pdf_file']
@@ -487,6 +1045,7 @@ def add_signature():
 
 # 12) Rotate PDF
 @app.route('/rotate-pdf', methods=['POST'])
+@admit('light')
 def rotate_pdf():
     try:
         file = request.files['file']
@@ -508,6 +1067,7 @@ def rotate_pdf():
 
 # 13) Extract All Text + Images (Replaces old 'extract-images')
 @app.route('/extract-all-content', methods=['POST'])
+@admit('heavy')
 def extract_all_content():
     try:
         file = request.files['file']
@@ -537,6 +1097,7 @@ def extract_all_content():
 
 # 14) Reorder PDF Pages
 @app.route('/reorder-pdf', methods=['POST'])
+@admit('light')
 def reorder_pdf():
     try:
         file = request.files['file']
@@ -565,6 +1126,7 @@ def reorder_pdf():
 
 # 15) Crop PDF
 @app.route('/crop-pdf', methods=['POST'])
+@admit('light')
 def crop_pdf():
     try:
         file = request.files['file']
@@ -594,6 +1156,7 @@ def crop_pdf():
 
 # 16) Edit PDF Metadata
 @app.route('/edit-metadata', methods=['POST'])
+@admit('light')
 def edit_metadata():
     try:
         file = request.files['file']
@@ -622,6 +1185,7 @@ def edit_metadata():
 # ==========================================
 
 @app.route('/get-pdf-text', methods=['POST'])
+@admit('heavy')
 def get_pdf_text():
     try:
         file = request.files['file']
@@ -663,13 +1227,15 @@ def get_pdf_text():
             })
         
         doc.close()
-        return jsonify({'success': True, 'pages': pages_data, 'total_pages': len(pages_data)})
+        doc_id = schedule_search_index(filepath)
+        return jsonify({'success': True, 'pages': pages_data, 'total_pages': len(pages_data), 'doc_id': doc_id})
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/edit-pdf', methods=['POST'])
+@admit('light')
 def edit_pdf():
     try:
         data = request.get_json()
@@ -719,5 +1285,312 @@ def edit_pdf():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+
+# ==========================================
+# FULL-TEXT SEARCH (POSITIONAL INDEX)
+# ==========================================
+# Uploaded PDFs have their words indexed once as term -> word positions. Each
+# position maps back to a page and bbox, so phrase/prefix queries return hit
+# rectangles without re-extracting text. Indexes are saved to disk under the
+# PDF's content hash, so any server process can load one instead of rebuilding.
+SEARCH_INDEX_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], 'search_index')
+SEARCH_TMP_MAX_AGE = 3600  # seconds before an unfinished index write is cleared
+
+def tokenize(text):
+    return re.findall(r'\w+', text.lower())
+
+class SearchIndex:
+    """Positional inverted index over every word of one document."""
+
+    def __init__(self, total_pages, pages, rects, postings):
+        self.total_pages = total_pages
+        self.pages = pages  # position -> page number
+        self.rects = rects  # position -> x0, y0, x1, y1
+        self.postings = postings  # term -> sorted array of positions
+        self.terms = sorted(postings)
+        self.nbytes = (pages.itemsize * len(pages) + rects.itemsize * len(rects)
+                       + sum(100 + 4 * len(positions) for positions in postings.values()))
+
+    @classmethod
+    def build(cls, doc):
+        pages, rects, postings = array('i'), array('f'), {}
+        for page in doc:
+            for x0, y0, x1, y1, word, *_ in page.get_text('words'):
+                for term in tokenize(word):
+                    postings.setdefault(term, array('i')).append(len(pages))
+                    pages.append(page.number)
+                    rects.extend((x0, y0, x1, y1))
+        return cls(len(doc), pages, rects, postings)
+
+    def save(self, path):
+        # A JSON header with the term table, then the raw arrays
+        header = json.dumps({
+            'total_pages': self.total_pages,
+            'words': len(self.pages),
+            'terms': self.terms,
+            'counts': [len(self.postings[term]) for term in self.terms],
+        }).encode('utf-8')
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(len(header).to_bytes(8, 'little'))
+                f.write(header)
+                self.pages.tofile(f)
+                self.rects.tofile(f)
+                for term in self.terms:
+                    self.postings[term].tofile(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            header = json.loads(f.read(int.from_bytes(f.read(8), 'little')))
+            pages, rects = array('i'), array('f')
+            pages.fromfile(f, header['words'])
+            rects.fromfile(f, 4 * header['words'])
+            postings = {}
+            for term, count in zip(header['terms'], header['counts']):
+                postings[term] = array('i')
+                postings[term].fromfile(f, count)
+            if f.read(1):
+                raise ValueError('Trailing data after search index')
+        return cls(header['total_pages'], pages, rects, postings)
+
+    def positions(self, term, prefix=False):
+        if not prefix:
+            return self.postings.get(term, array('i'))
+        i = bisect.bisect_left(self.terms, term)
+        matches = []
+        while i < len(self.terms) and self.terms[i].startswith(term):
+            matches.append(self.postings[self.terms[i]])
+            i += 1
+        if len(matches) == 1:
+            return matches[0]
+        return array('i', sorted(p for positions in matches for p in positions))
+
+    def search(self, query, prefix=False, limit=100):
+        """Find the query as a phrase on one page; with prefix, its last word may be a prefix."""
+        terms = tokenize(query)
+        if not terms:
+            return []
+        postings = [self.positions(term, prefix and i == len(terms) - 1) for i, term in enumerate(terms)]
+
+        # Walk the rarest term and check the others sit at the right offsets
+        anchor = min(range(len(terms)), key=lambda i: len(postings[i]))
+        starts = []
+        for position in postings[anchor]:
+            start = position - anchor
+            end = start + len(terms) - 1
+            if start < 0 or end >= len(self.pages) or self.pages[start] != self.pages[end]:
+                continue  # phrases do not run across a page break
+            if all(contains(positions, start + i) for i, positions in enumerate(postings) if i != anchor):
+                starts.append(start)
+                if len(starts) >= limit:
+                    break
+
+        return [self.hit(start, len(terms)) for start in starts]
+
+    def hit(self, start, length):
+        rects = []
+        for position in range(start, start + length):
+            x0, y0, x1, y1 = self.rects[4 * position:4 * position + 4]
+            rect = {'x': x0, 'y': y0, 'width': x1 - x0, 'height': y1 - y0}
+            if rect not in rects:  # words split like 'e-mail' share one rect
+                rects.append(rect)
+        return {'page': self.pages[start], 'rects': rects}
+
+def contains(positions, value):
+    i = bisect.bisect_left(positions, value)
+    return i < len(positions) and positions[i] == value
+
+class SearchIndexCache:
+    """Least-recently-used SearchIndex cache bounded by estimated size."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.indexes = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, doc_id):
+        with self.lock:
+            index = self.indexes.get(doc_id)
+            if index:
+                self.indexes.move_to_end(doc_id)
+            return index
+
+    def put(self, doc_id, index):
+        with self.lock:
+            if doc_id in self.indexes:
+                self.total_bytes -= self.indexes.pop(doc_id).nbytes
+            self.indexes[doc_id] = index
+            self.total_bytes += index.nbytes
+            while self.total_bytes > self.max_bytes and len(self.indexes) > 1:
+                _, evicted = self.indexes.popitem(last=False)
+                self.total_bytes -= evicted.nbytes
+
+search_cache = SearchIndexCache(app.config['SEARCH_CACHE_MB'] * 1024 * 1024)
+search_build_locks = {}
+search_build_locks_lock = threading.Lock()
+
+def search_index_path(doc_id):
+    if not re.fullmatch(r'[0-9a-f]{64}', doc_id):
+        return None
+    return os.path.join(SEARCH_INDEX_FOLDER, doc_id + '.idx')
+
+def file_sha256(filepath):
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def prune_search_indexes():
+    # Clear abandoned temp files, then drop the least recently used indexes
+    # once the folder is over budget
+    entries = []
+    now = time.time()
+    for name in os.listdir(SEARCH_INDEX_FOLDER):
+        path = os.path.join(SEARCH_INDEX_FOLDER, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if name.endswith('.tmp'):
+            if stat.st_mtime < now - SEARCH_TMP_MAX_AGE:
+                remove_quietly(path)
+        elif name.endswith('.idx'):
+            entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    budget = app.config['SEARCH_DISK_MB'] * 1024 * 1024
+    for _, size, path in entries[:-1]:
+        if total <= budget:
+            break
+        remove_quietly(path)
+        total -= size
+
+def get_search_index(doc_id):
+    """Return a built index from memory or disk, or None if there is none."""
+    index = search_cache.get(doc_id)
+    if index:
+        return index
+    path = search_index_path(doc_id)
+    if not path:
+        return None
+    try:
+        index = SearchIndex.load(path)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        remove_quietly(path)  # truncated or foreign file; treat as never indexed
+        return None
+    try:
+        os.utime(path)  # keeps it off the eviction list
+    except FileNotFoundError:
+        pass  # pruned by another process just now; the loaded copy is still good
+    search_cache.put(doc_id, index)
+    return index
+
+def build_search_index(doc_id, open_doc):
+    """Build and save the index unless one exists; open_doc() opens the PDF."""
+    with search_build_locks_lock:
+        build_lock = search_build_locks.setdefault(doc_id, threading.Lock())
+    with build_lock:
+        index = get_search_index(doc_id)
+        if not index:
+            with open_doc() as doc:
+                index = SearchIndex.build(doc)
+            os.makedirs(SEARCH_INDEX_FOLDER, exist_ok=True)
+            index.save(search_index_path(doc_id))
+            search_cache.put(doc_id, index)
+            prune_search_indexes()
+    with search_build_locks_lock:
+        search_build_locks.pop(doc_id, None)
+    return index
+
+def schedule_search_index(filepath):
+    """Return the PDF's doc_id and index it in the background if needed.
+
+    The build waits for a 'heavy' slot in its own thread, so the upload that
+    triggered it is not held up. If heavy work is saturated the build is
+    skipped and /search/index can be used instead.
+    """
+    doc_id = file_sha256(filepath)
+    if get_search_index(doc_id):
+        return doc_id
+    with open(filepath, 'rb') as f:
+        data = f.read()  # the upload path is reused by the next upload
+
+    def build():
+        gate = admission_gates['heavy']
+        if gate.acquire():
+            return
+        started = time.monotonic()
+        try:
+            build_search_index(doc_id, lambda: fitz.open(stream=data, filetype='pdf'))
+        except Exception:
+            pass  # /search reports the document as not indexed
+        finally:
+            gate.release(time.monotonic() - started)
+
+    threading.Thread(target=build, daemon=True).start()
+    return doc_id
+
+@app.route('/search/index', methods=['POST'])
+@admit('heavy')
+def index_for_search():
+    try:
+        file = request.files['file']
+        if not file: return jsonify({'error': 'Invalid file'}), 400
+        
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], f'search_upload_{uuid.uuid4().hex}.pdf')
+        file.save(filepath)
+        try:
+            doc_id = file_sha256(filepath)
+            index = build_search_index(doc_id, lambda: fitz.open(filepath))
+        finally:
+            os.remove(filepath)
+        
+        return jsonify({'success': True, 'doc_id': doc_id, 'total_pages': index.total_pages,
+                        'total_words': len(index.pages)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/search', methods=['GET', 'POST'])
+@admit('light')
+def search_pdf():
+    try:
+        params = request.get_json(silent=True) or request.values
+        doc_id = str(params.get('doc_id', ''))
+        query = str(params.get('q', ''))
+        prefix = str(params.get('prefix', '')).lower() in ('1', 'true', 'yes')
+        try:
+            limit = max(1, min(int(params.get('limit', 100)), app.config['SEARCH_MAX_HITS']))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'limit must be a whole number'}), 400
+        if not query.strip(): return jsonify({'error': 'No query provided'}), 400
+        
+        # Only ever load a saved index here; building one is heavy work
+        index = get_search_index(doc_id)
+        if not index:
+            return jsonify({'error': 'Document not indexed (yet). Retry shortly or upload it to /search/index.'}), 404
+        
+        hits = index.search(query, prefix=prefix, limit=limit + 1)
+        return jsonify({'success': True, 'doc_id': doc_id, 'query': query, 'hits': hits[:limit],
+                        'returned_hits': min(len(hits), limit), 'truncated': len(hits) > limit})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,25 @@
+# Production server config: gunicorn -c gunicorn.conf.py app:app
+import multiprocessing
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from server_sizing import server_sizing
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', max(2, multiprocessing.cpu_count() // 2)))
+worker_class = 'gthread'
+
+# One thread per admission slot and queue place (see server_sizing.py); a
+# PDFSUITE_THREADS override only changes how many go to light page tools
+threads = server_sizing(workers, int(os.environ.get('PDFSUITE_THREADS', 0)) or None)['threads']
+
+# app.py sizes its admission classes from the same numbers
+os.environ['PDFSUITE_WORKERS'] = str(workers)
+os.environ['PDFSUITE_THREADS'] = str(threads)
+
+# Long enough for a PDF → Word conversion to hit its own WORD_TIMEOUT first
+timeout = 360
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
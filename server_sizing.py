@@ -0,0 +1,33 @@
+# Per-process server sizing, shared by gunicorn.conf.py and app.py so the
+# thread count and the admission limits always come from the same numbers.
+import os
+
+
+def server_sizing(workers=1, threads=None, cpus=None):
+    """Admission classes and thread count for one server process.
+
+    Every route goes through an admission class, and the thread count is the
+    sum of every class's limit and wait queue, so a request that is admitted
+    or queued always holds a thread of its own. A ``threads`` value that is too
+    small for the fixed classes is raised to the minimum that fits.
+    """
+    cpus = cpus or os.cpu_count() or 1
+    heavy = max(1, cpus // workers)  # about one heavy job per CPU across the host
+    classes = {
+        # OCR, conversions and whole-document extraction
+        'heavy': {'limit': heavy, 'queue': heavy, 'timeout': 30},
+        # PDF → Word runs its own cpus // workers processes per conversion
+        'word': {'limit': 1, 'queue': 1, 'timeout': 30},
+        # HTML pages, job polls and downloads, metrics
+        'status': {'limit': 2, 'queue': 4, 'timeout': 5},
+    }
+    reserved = sum(c['limit'] + c['queue'] for c in classes.values())
+    light_threads = max(2, threads - reserved) if threads else 2 * max(4, heavy)
+    light_limit = max(1, light_threads // 2)
+    # cheap page operations (split, rotate, ...)
+    classes['light'] = {'limit': light_limit, 'queue': light_threads - light_limit, 'timeout': 10}
+    return {
+        'heavy_limit': heavy,
+        'threads': reserved + light_threads,
+        'classes': classes,
+    }